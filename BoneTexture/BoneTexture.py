@@ -1,15 +1,17 @@
+import collections
+import concurrent.futures
 import csv
+import functools
+import io
 import logging
+import numpy as np
 import os
 import qt
 import slicer
+import vtk
 from slicer.ScriptedLoadableModule import *
 from slicer.util import VTKObservationMixin
-# Use segment statistics to compute good default parameters for texture modules.
-import SegmentStatistics
-
-import math  # for ceil
-import VectorToScalarVolume # For extra widget, handling input vector/RGB images.
+from slicer.parameterNodeWrapper import parameterNodeWrapper
 
 ################################################################################
 ############################  Bone Texture #####################################
@@ -57,23 +59,44 @@ class TableCopyFilter(qt.QWidget):
             rows = sorted(set(index.row() for index in selection))
             cols = sorted(set(index.column() for index in selection))
 
-            # allow looking up index data by coordinate
-            data = {(index.row(), index.column()): index.data() for index in selection}
+            rowIndex = {row: i for i, row in enumerate(rows)}
+            colIndex = {col: j for j, col in enumerate(cols)}
 
-            # fetch a full grid of rows x columns. missing (unselected) values are ''
-            parts = [[data.get((row, col), '') for col in cols] for row in rows]
+            # fill a full grid of rows x columns in one pass. missing (unselected) values are ''
+            grid = np.full((len(rows), len(cols)), '', dtype=object)
+            for index in selection:
+                grid[rowIndex[index.row()], colIndex[index.column()]] = index.data() or ''
 
             # join table into tsv-formatted text
-            text = '\n'.join('\t'.join(part) for part in parts)
+            text = '\n'.join('\t'.join(part) for part in grid.tolist())
 
             slicer.app.clipboard().setText(text)
 
+
+@parameterNodeWrapper
+class BoneTextureParameterNode:
+    """ Parameters of the texture CLIs, bound to the spinboxes through their SlicerParameterName property. """
+    GLCMInsideMask: int = 1
+    GLCMBinNumber: int = 10
+    GLCMPixelIntensityMin: int = 0
+    GLCMPixelIntensityMax: int = 4000
+    GLCMNeighborhoodRadius: int = 4
+    GLRLMInsideMask: int = 1
+    GLRLMBinNumber: int = 10
+    GLRLMPixelIntensityMin: int = 0
+    GLRLMPixelIntensityMax: int = 4000
+    GLRLMNeighborhoodRadius: int = 4
+    GLRLMDistanceMin: float = 0.0
+    GLRLMDistanceMax: float = 1.0
+    BMThreshold: int = 1
+    BMNeighborhoodRadius: int = 4
+
 ################################################################################
 ##########################  Bone Texture Widget ################################
 ################################################################################
 
 
-class BoneTextureWidget(ScriptedLoadableModuleWidget):
+class BoneTextureWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
 
     # ************************************************************************ #
     # -------------------------- Initialisation ------------------------------ #
@@ -81,7 +104,10 @@ class BoneTextureWidget(ScriptedLoadableModuleWidget):
 
     def __init__(self, parent=None):
         ScriptedLoadableModuleWidget.__init__(self, parent)
+        VTKObservationMixin.__init__(self)
         self.logic = BoneTextureLogic(self)
+        self.parameterNode = None
+        self.parameterNodeGuiTag = None
 
         self.CFeatures = ["energy", "entropy",
                           "correlation", "inverseDifferenceMoment",
@@ -102,27 +128,6 @@ class BoneTextureWidget(ScriptedLoadableModuleWidget):
         scriptedModulesPath = eval('slicer.modules.%s.path' % self.moduleName.lower())
         scriptedModulesPath = os.path.dirname(scriptedModulesPath)
 
-        # - Init parameters. - #
-        # TODO (EASY): a parameter node should be maintained instead of these dictionaries. - #
-
-        self.GLCMFeaturesValueDict = {}
-        self.GLCMFeaturesValueDict["insideMask"] = 1
-        self.GLCMFeaturesValueDict["binNumber"] = 10
-        self.GLCMFeaturesValueDict["pixelIntensityMin"] = 0
-        self.GLCMFeaturesValueDict["pixelIntensityMax"] = 4000
-        self.GLCMFeaturesValueDict["neighborhoodRadius"] = 4
-        self.GLRLMFeaturesValueDict = {}
-        self.GLRLMFeaturesValueDict["insideMask"] = 1
-        self.GLRLMFeaturesValueDict["binNumber"] = 10
-        self.GLRLMFeaturesValueDict["pixelIntensityMin"] = 0
-        self.GLRLMFeaturesValueDict["pixelIntensityMax"] = 4000
-        self.GLRLMFeaturesValueDict["neighborhoodRadius"] = 4
-        self.GLRLMFeaturesValueDict["distanceMin"] = 0.00
-        self.GLRLMFeaturesValueDict["distanceMax"] = 1.00
-        self.BMFeaturesValueDict = {}
-        self.BMFeaturesValueDict["threshold"] = 1
-        self.BMFeaturesValueDict["neighborhoodRadius"] = 4
-
         # -------------------------------------------------------------------- #
         # ----------------- Definition of the UI interface ------------------- #
         # -------------------------------------------------------------------- #
@@ -137,6 +142,7 @@ class BoneTextureWidget(ScriptedLoadableModuleWidget):
         self.layout = self.parent.layout()
         self.widget = widget
         self.layout.addWidget(widget)
+        self.ui = slicer.util.childWidgetVariables(widget)
 
         # ---------------- Input Data Collapsible Button --------------------- #
 
@@ -149,6 +155,7 @@ class BoneTextureWidget(ScriptedLoadableModuleWidget):
         self.inputSegmentationMRMLNodeComboBox.setMRMLScene(slicer.mrmlScene)
         # Add a python widget from core slicer scripted module: VectorToScalarModule
         # It works fine, but that module should be written in c++ to be truly reusable with qtdesigner,
+        import VectorToScalarVolume  # imported here to keep the module import light
         self.vectorToScalarVolumeGroupBox = qt.QGroupBox(self.inputDataCollapsibleButton)
         self.vectorToScalarVolumeGroupBox.setTitle("Conversion: Vector Input Scan to Scalar")
         self.vectorToScalarVolumeLayout = qt.QVBoxLayout(self.vectorToScalarVolumeGroupBox)
@@ -160,7 +167,8 @@ class BoneTextureWidget(ScriptedLoadableModuleWidget):
         self.inputDataVerticalLayout.addWidget(self.vectorToScalarVolumeGroupBox)
         vectorToScalarIndex = self.vectorToScalarVolumeConversionWidget.methodSelectorComboBox.findData(
             VectorToScalarVolume.VectorToScalarVolumeLogic.LUMINANCE)
-        self.vectorToScalarVolumeConversionWidget.methodSelectorComboBox.setCurrentIndex(vectorToScalarIndex)
+        if vectorToScalarIndex >= 0:
+            self.vectorToScalarVolumeConversionWidget.methodSelectorComboBox.setCurrentIndex(vectorToScalarIndex)
         self.vectorToScalarVolumeGroupBox.enabled = False
 
         # ---------------- Computation Collapsible Button -------------------- #
@@ -201,6 +209,10 @@ class BoneTextureWidget(ScriptedLoadableModuleWidget):
         self.displayFeaturesTableWidget = self.logic.get("displayFeaturesTableWidget")
         self.SaveTablePushButton = self.logic.get("SaveTablePushButton")
         self.CSVPathLineEdit = self.logic.get("CSVPathLineEdit")
+        # Table cells receiving the feature values, one column per feature set
+        self.GLCMFeatureItems = [self.displayFeaturesTableWidget.item(i, 1) for i in range(len(self.CFeatures))]
+        self.GLRLMFeatureItems = [self.displayFeaturesTableWidget.item(i, 3) for i in range(len(self.RLFeatures))]
+        self.BMFeatureItems = [self.displayFeaturesTableWidget.item(i, 5) for i in range(len(self.BMFeatures))]
 
         # -------------------------------------------------------------------- #
         # ---------------------------- Connections --------------------------- #
@@ -217,36 +229,6 @@ class BoneTextureWidget(ScriptedLoadableModuleWidget):
                 self.inputScanMRMLNodeComboBox.currentNode())
         )
         self.vectorToScalarVolumePushButton.connect('clicked()', self.onVectorToScalarVolumePushButtonClicked)
-        # ---------------- Computation Collapsible Button --------------------- #
-
-        self.GLCMinsideMaskValueSpinBox.connect('valueChanged(int)',
-                                                lambda: self.onGLCMFeaturesValueDictModified("insideMask", self.GLCMinsideMaskValueSpinBox.value))
-        self.GLCMnumberOfBinsSpinBox.connect('valueChanged(int)',
-                                             lambda: self.onGLCMFeaturesValueDictModified("binNumber", self.GLCMnumberOfBinsSpinBox.value))
-        self.GLCMminVoxelIntensitySpinBox.connect('valueChanged(int)',
-                                                  lambda: self.onGLCMFeaturesValueDictModified("pixelIntensityMin", self.GLCMminVoxelIntensitySpinBox.value))
-        self.GLCMmaxVoxelIntensitySpinBox.connect('valueChanged(int)',
-                                                  lambda: self.onGLCMFeaturesValueDictModified("pixelIntensityMax", self.GLCMmaxVoxelIntensitySpinBox.value))
-        self.GLCMneighborhoodRadiusSpinBox.connect('valueChanged(int)',
-                                                   lambda: self.onGLCMFeaturesValueDictModified("neighborhoodRadius", self.GLCMneighborhoodRadiusSpinBox.value))
-        self.GLRLMinsideMaskValueSpinBox.connect('valueChanged(int)',
-                                                 lambda: self.onGLRLMFeaturesValueDictModified("insideMask", self.GLRLMinsideMaskValueSpinBox.value))
-        self.GLRLMnumberOfBinsSpinBox.connect('valueChanged(int)',
-                                              lambda: self.onGLRLMFeaturesValueDictModified("binNumber", self.GLRLMnumberOfBinsSpinBox.value))
-        self.GLRLMminVoxelIntensitySpinBox.connect('valueChanged(int)',
-                                                   lambda: self.onGLRLMFeaturesValueDictModified("pixelIntensityMin", self.GLRLMminVoxelIntensitySpinBox.value))
-        self.GLRLMmaxVoxelIntensitySpinBox.connect('valueChanged(int)',
-                                                   lambda: self.onGLRLMFeaturesValueDictModified("pixelIntensityMax", self.GLRLMmaxVoxelIntensitySpinBox.value))
-        self.GLRLMminDistanceSpinBox.connect('valueChanged(double)',
-                                             lambda: self.onGLRLMFeaturesValueDictModified("distanceMin", self.GLRLMminDistanceSpinBox.value))
-        self.GLRLMmaxDistanceSpinBox.connect('valueChanged(double)',
-                                             lambda: self.onGLRLMFeaturesValueDictModified("distanceMax", self.GLRLMmaxDistanceSpinBox.value))
-        self.GLRLMneighborhoodRadiusSpinBox.connect('valueChanged(int)',
-                                                    lambda: self.onGLRLMFeaturesValueDictModified("neighborhoodRadius", self.GLRLMneighborhoodRadiusSpinBox.value))
-        self.BMthresholdSpinBox.connect('valueChanged(int)',
-                                        lambda: self.onBMFeaturesValueDictModified("threshold", self.BMthresholdSpinBox.value))
-        self.BMneighborhoodRadiusSpinBox.connect('valueChanged(int)',
-                                                 lambda: self.onBMFeaturesValueDictModified("neighborhoodRadius", self.BMneighborhoodRadiusSpinBox.value))
 
         # ----------- Compute Parameters Based on Inputs Button -------------- #
         self.computeParametersBasedOnInputs.connect('clicked()', self.onComputeParametersBasedOnInputs)
@@ -267,10 +249,38 @@ class BoneTextureWidget(ScriptedLoadableModuleWidget):
         # -------------------------- Initialisation -------------------------- #
         # -------------------------------------------------------------------- #
 
+        # The parameter spinboxes are bound to the parameter node, see setParameterNode
+        self.addObserver(slicer.mrmlScene, slicer.mrmlScene.StartCloseEvent, self.onSceneStartClose)
+        self.addObserver(slicer.mrmlScene, slicer.mrmlScene.EndCloseEvent, self.onSceneEndClose)
+        self.initializeParameterNode()
+
         # ******************************************************************** #
         # ----------------------- Algorithm ---------------------------------- #
         # ******************************************************************** #
 
+        # ------------------------ Parameter Node ---------------------------- #
+
+    def enter(self):
+        self.initializeParameterNode()
+
+    def onSceneStartClose(self, caller, event):
+        self.setParameterNode(None)
+        self.logic.clearCaches()
+
+    def onSceneEndClose(self, caller, event):
+        if self.parent.isEntered:
+            self.initializeParameterNode()
+
+    def initializeParameterNode(self):
+        self.setParameterNode(self.logic.getParameterNode())
+
+    def setParameterNode(self, parameterNode):
+        if self.parameterNode is not None:
+            self.parameterNode.disconnectGui(self.parameterNodeGuiTag)
+        self.parameterNode = parameterNode
+        if self.parameterNode is not None:
+            self.parameterNodeGuiTag = self.parameterNode.connectGui(self.ui)
+
         # ---------------- Input Data Collapsible Button --------------------- #
 
     def onInputScanChanged(self):
@@ -289,6 +299,7 @@ class BoneTextureWidget(ScriptedLoadableModuleWidget):
         Convert current input VectorVolume to a ScalarVolume.
         And set that ScalarVolume as the new input.
         """
+        import VectorToScalarVolume
         # create and add output node to scene (hide this selection from user)
         inputVolumeNode = self.inputScanMRMLNodeComboBox.currentNode()
         conversionMethod = self.vectorToScalarVolumeConversionWidget.conversionMethod()
@@ -316,15 +327,6 @@ class BoneTextureWidget(ScriptedLoadableModuleWidget):
             slicer.mrmlScene.RemoveNode(outputVolumeNode)
 
 
-    def onGLCMFeaturesValueDictModified(self, key, value):
-        self.GLCMFeaturesValueDict[key] = value
-
-    def onGLRLMFeaturesValueDictModified(self, key, value):
-        self.GLRLMFeaturesValueDict[key] = value
-
-    def onBMFeaturesValueDictModified(self, key, value):
-        self.BMFeaturesValueDict[key] = value
-
         # ---------------- Computation Collapsible Button -------------------- #
 
     def onComputeParametersBasedOnInputs(self):
@@ -334,49 +336,71 @@ class BoneTextureWidget(ScriptedLoadableModuleWidget):
         if isValid is False:
             return
 
-        minIntensityValue, maxIntensityValue = self.logic.computeLabelStatistics(inputScan, inputSegmentation)
-        numBins = self.logic.computeBinsBasedOnIntensityRange(minIntensityValue, maxIntensityValue)
-
-        self.GLCMnumberOfBinsSpinBox.value = numBins
-        self.GLCMminVoxelIntensitySpinBox.value = minIntensityValue
-        self.GLCMmaxVoxelIntensitySpinBox.value = maxIntensityValue
-        self.GLRLMnumberOfBinsSpinBox.value = numBins
-        self.GLRLMminVoxelIntensitySpinBox.value = minIntensityValue
-        self.GLRLMmaxVoxelIntensitySpinBox.value = maxIntensityValue
+        # Avoid view redraws while the statistics and the parameters are updated
+        slicer.app.pauseRender()
+        try:
+            if self.logic.isSegmentationEmpty(inputSegmentation):
+                slicer.util.warningDisplay("The input segmentation is empty, the parameters are left unchanged")
+                return
+            minIntensityValue, maxIntensityValue = self.logic.computeLabelStatistics(inputScan, inputSegmentation)
+            if maxIntensityValue <= minIntensityValue:
+                slicer.util.warningDisplay("The intensity is constant inside the segmentation, the parameters are left unchanged")
+                return
+            numBins = self.logic.computeBinsBasedOnIntensityRange(minIntensityValue, maxIntensityValue)
+
+            minIntensityValue = int(np.floor(minIntensityValue))
+            maxIntensityValue = int(np.ceil(maxIntensityValue))
+
+            # Update the parameter node with a single Modified event, the spinboxes follow it.
+            with slicer.util.NodeModify(self.parameterNode.parameterNode):
+                self.parameterNode.GLCMBinNumber = numBins
+                self.parameterNode.GLCMPixelIntensityMin = minIntensityValue
+                self.parameterNode.GLCMPixelIntensityMax = maxIntensityValue
+                self.parameterNode.GLRLMBinNumber = numBins
+                self.parameterNode.GLRLMPixelIntensityMin = minIntensityValue
+                self.parameterNode.GLRLMPixelIntensityMax = maxIntensityValue
+        finally:
+            slicer.app.resumeRender()
 
     def onComputeFeatures(self):
         # This will run async, and populate self.logic.featuresXXX
+        GLCMFeaturesValueDict, GLRLMFeaturesValueDict, BMFeaturesValueDict = \
+            self.logic.featuresValueDicts(self.parameterNode)
         self.logic.computeFeatures(self.inputScanMRMLNodeComboBox.currentNode(),
                                    self.inputSegmentationMRMLNodeComboBox.currentNode(),
                                    self.gLCMFeaturesCheckBox.isChecked(),
                                    self.gLRLMFeaturesCheckBox.isChecked(),
                                    self.bMFeaturesCheckBox.isChecked(),
-                                   self.GLCMFeaturesValueDict,
-                                   self.GLRLMFeaturesValueDict,
-                                   self.BMFeaturesValueDict)
+                                   GLCMFeaturesValueDict,
+                                   GLRLMFeaturesValueDict,
+                                   BMFeaturesValueDict)
 
     def onDisplayFeatures(self):
-        if self.logic.featuresGLCM is not None:
-            for i in range(8):
-                self.displayFeaturesTableWidget.item(i,1).setText(self.logic.featuresGLCM[i])
-
-        if self.logic.featuresGLRLM is not None:
-            for i in range(10):
-                self.displayFeaturesTableWidget.item(i, 3).setText(self.logic.featuresGLRLM[i])
-
-        if self.logic.featuresBM is not None:
-            for i in range(5):
-                self.displayFeaturesTableWidget.item(i, 5).setText(self.logic.featuresBM[i])
+        from BoneTextureLib.FeaturesFile import formatFeature
+        # Update all the cells with painting disabled, then repaint the table once
+        self.displayFeaturesTableWidget.setUpdatesEnabled(False)
+        try:
+            for items, features in ((self.GLCMFeatureItems, self.logic.featuresGLCM),
+                                    (self.GLRLMFeatureItems, self.logic.featuresGLRLM),
+                                    (self.BMFeatureItems, self.logic.featuresBM)):
+                if features is None:
+                    continue
+                for item, value in zip(items, features):
+                    item.setText(formatFeature(value))
+        finally:
+            self.displayFeaturesTableWidget.setUpdatesEnabled(True)
 
     def onComputeColormaps(self):
+        GLCMFeaturesValueDict, GLRLMFeaturesValueDict, BMFeaturesValueDict = \
+            self.logic.featuresValueDicts(self.parameterNode)
         self.logic.computeColormaps(self.inputScanMRMLNodeComboBox.currentNode(),
                                     self.inputSegmentationMRMLNodeComboBox.currentNode(),
                                     self.gLCMFeaturesCheckBox.isChecked(),
                                     self.gLRLMFeaturesCheckBox.isChecked(),
                                     self.bMFeaturesCheckBox.isChecked(),
-                                    self.GLCMFeaturesValueDict,
-                                    self.GLRLMFeaturesValueDict,
-                                    self.BMFeaturesValueDict)
+                                    GLCMFeaturesValueDict,
+                                    GLRLMFeaturesValueDict,
+                                    BMFeaturesValueDict)
 
         # ----------------- Results Collapsible Button ----------------------- #
 
@@ -395,29 +419,45 @@ class BoneTextureWidget(ScriptedLoadableModuleWidget):
         applicationLogic.PropagateVolumeSelection(mode, 0)
 
         # Set the good feature names in the featureCombobox
-        if node.GetDisplayNode().GetInputImageData().GetNumberOfScalarComponents() == 8:
-            self.featureComboBox.addItems(self.CFeatures)
-        elif node.GetDisplayNode().GetInputImageData().GetNumberOfScalarComponents() == 10:
-            self.featureComboBox.addItems(self.RLFeatures)
-        elif node.GetDisplayNode().GetInputImageData().GetNumberOfScalarComponents() == 5:
-            self.featureComboBox.addItems(self.BMFeatures)
+        numberOfComponents = node.GetDisplayNode().GetInputImageData().GetNumberOfScalarComponents()
+        featureNames = {len(self.CFeatures): self.CFeatures,
+                        len(self.RLFeatures): self.RLFeatures,
+                        len(self.BMFeatures): self.BMFeatures}.get(numberOfComponents)
+        if featureNames is not None:
+            self.featureComboBox.addItems(featureNames)
 
     def onFeatureChanged(self, index):
-        if self.featureSetMRMLNodeComboBox.currentNode():
-            # Change the feature displayed to the one wanted by the user
-            self.featureSetMRMLNodeComboBox.currentNode().GetDisplayNode().SetDiffusionComponent(index)
+        node = self.featureSetMRMLNodeComboBox.currentNode()
+        if node is None or index < 0:
+            return
+        # Change the feature displayed to the one wanted by the user. Only the diffusion weighted
+        # display node can show a single component of a multi-component volume with a color table.
+        displayNode = node.GetDisplayNode()
+        if displayNode is not None and hasattr(displayNode, "SetDiffusionComponent"):
+            displayNode.SetDiffusionComponent(index)
 
     def onSaveTable(self):
         self.logic.SaveTableAsCSV(self.displayFeaturesTableWidget,self.CSVPathLineEdit.currentPath)
 
     def cleanup(self):
-        pass
+        self.removeObservers()
 
 
 ################################################################################
 ############################  Bone Texture Logic ###############################
 ################################################################################
 class BoneTextureLogic(ScriptedLoadableModuleLogic, VTKObservationMixin):
+    # Value of the voxels outside of the intensity range in the quantized scan
+    OUT_OF_RANGE_BIN = 255
+    # Feature set -> (CLI module name in slicer.modules, whether its input can be quantized)
+    FEATURE_JOBS = {"GLCM": ("computeglcmfeatures", True),
+                    "GLRLM": ("computeglrlmfeatures", True),
+                    "BM": ("computebmfeatures", False)}
+    # Feature set -> (logic attribute holding the features, output vector in ComputeAllFeatures, number of features)
+    FEATURE_SETS = {"GLCM": ("featuresGLCM", "GLCMOutputVector", 8),
+                    "GLRLM": ("featuresGLRLM", "GLRLMOutputVector", 10),
+                    "BM": ("featuresBM", "BMOutputVector", 5)}
+
     # ************************************************************************ #
     # ----------------------- Initialisation --------------------------------- #
     # ************************************************************************ #
@@ -427,6 +467,36 @@ class BoneTextureLogic(ScriptedLoadableModuleLogic, VTKObservationMixin):
         ScriptedLoadableModuleLogic.__init__(self)
         VTKObservationMixin.__init__(self)
         self.interface = interface
+        # objectName -> widget lookup table, built on first call to get()
+        self.widgetIndex = None
+        # Inputs (IDs, MTimes, method) and (min, max) of the last computeLabelStatistics call
+        self.labelStatisticsCache = None
+        # Inputs (IDs, MTimes) of the last successful inputDataVerification call
+        self.verifiedInputs = None
+        # Compute the GLCM feature maps with the CUDA backend when CuPy and a GPU are available.
+        # The backend runs synchronously on the main thread, unlike the asynchronous CLI.
+        self.useGPU = False
+        # Width of the co-occurrence counters of the GPU backend, 16 falls back to 32 for large neighborhoods
+        self.accumulatorBitWidth = 16
+        # Run the GLCM and GLRLM features CLIs on a uint8 volume of bin indices instead of the native scan
+        self.quantizeInput = False
+        # Run the feature CLIs on the scan and segmentation cropped to the bounding box of the segmentation
+        self.cropToSegmentation = True
+        # Temporary cropped and quantized volumes, keyed by the ID of the CLI nodes using them
+        self.temporaryNodes = {}
+        # Threads used by the feature map CLIs, leaving one core to keep Slicer responsive
+        self.numberOfThreads = max(1, (os.cpu_count() or 1) - 1)
+        # Running feature CLIs: "GLCM", "GLRLM", "BM" or "All" -> (CLI node, observer tag, future)
+        self.featureObservers = {}
+        # Cancelled feature CLIs still stopping, keyed by node ID -> (CLI node, observer tag, future).
+        # They keep their temporary nodes and features file until they are no longer busy.
+        self.cancelledFeatureCLIs = {}
+        # Read the features from the float32 file written by the CLIs instead of parsing the output vectors
+        self.readFeaturesFromFile = True
+        # Temporary features files, keyed by the ID of the CLI node writing them
+        self.featuresFiles = {}
+        # ID of the color node of the colormaps, see rainbowColorNodeID()
+        self.rainbowID = None
         # Outputs:
         self.featuresGLCM = None
         self.featuresGLRLM = None
@@ -434,42 +504,98 @@ class BoneTextureLogic(ScriptedLoadableModuleLogic, VTKObservationMixin):
 
     def __del__(self):
         self.removeObservers()
+        for cliNode, tag, _ in list(self.featureObservers.values()) + list(self.cancelledFeatureCLIs.values()):
+            cliNode.RemoveObserver(tag)
+
+    def getParameterNode(self):
+        return BoneTextureParameterNode(ScriptedLoadableModuleLogic.getParameterNode(self))
+
+    def featuresValueDicts(self, parameterNode):
+        """ Split the parameter node into the GLCM, GLRLM and BM parameter dictionaries of the CLIs.
+        Returns tuple (GLCMFeaturesValueDict, GLRLMFeaturesValueDict, BMFeaturesValueDict). """
+        GLCMFeaturesValueDict = {"insideMask": parameterNode.GLCMInsideMask,
+                                 "binNumber": parameterNode.GLCMBinNumber,
+                                 "pixelIntensityMin": parameterNode.GLCMPixelIntensityMin,
+                                 "pixelIntensityMax": parameterNode.GLCMPixelIntensityMax,
+                                 "neighborhoodRadius": parameterNode.GLCMNeighborhoodRadius}
+        GLRLMFeaturesValueDict = {"insideMask": parameterNode.GLRLMInsideMask,
+                                  "binNumber": parameterNode.GLRLMBinNumber,
+                                  "pixelIntensityMin": parameterNode.GLRLMPixelIntensityMin,
+                                  "pixelIntensityMax": parameterNode.GLRLMPixelIntensityMax,
+                                  "neighborhoodRadius": parameterNode.GLRLMNeighborhoodRadius,
+                                  "distanceMin": parameterNode.GLRLMDistanceMin,
+                                  "distanceMax": parameterNode.GLRLMDistanceMax}
+        BMFeaturesValueDict = {"threshold": parameterNode.BMThreshold,
+                               "neighborhoodRadius": parameterNode.BMNeighborhoodRadius}
+        return GLCMFeaturesValueDict, GLRLMFeaturesValueDict, BMFeaturesValueDict
 
     def isClose(self, a, b, rel_tol=0.0, abs_tol=0.0):
-        for i in range(len(a)):
-            if not (abs(a[i] - b[i]) <= max(rel_tol * max(abs(a[i]), abs(b[i])), abs_tol)):
-                return False
-        return True
-
-    def computeLabelStatistics(self, inputScan, inputLabelMapNode):
-        """ Use slicer core module to get the min/max intensity value inside the mask.
-        Returns tuple (min, max) with intensity values inside the mask. """
-        # Export lapel map node into a segmentation node
-        segmentationNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLSegmentationNode")
-        slicer.modules.segmentations.logic().ImportLabelmapToSegmentationNode(inputLabelMapNode, segmentationNode)
-
-        # Compute statistics (may take time)
-        segStatLogic = SegmentStatistics.SegmentStatisticsLogic()
-        segStatLogic.getParameterNode().SetParameter("Segmentation", segmentationNode.GetID())
-        segStatLogic.getParameterNode().SetParameter("ScalarVolume", inputScan.GetID())
-
-        # Disable all plugins
-        for plugin in segStatLogic.plugins:
-          pluginName = plugin.__class__.__name__
-          segStatLogic.getParameterNode().SetParameter(f"{pluginName}.enabled", str(False))
+        return bool(np.allclose(np.asarray(a, dtype=np.float64), np.asarray(b, dtype=np.float64),
+                                rtol=rel_tol, atol=abs_tol))
+
+    def computeLabelStatistics(self, inputScan, inputLabelMapNode, useSegmentStatistics=False):
+        """ Get the min/max intensity value inside the mask (voxels with a label > 0).
+        If useSegmentStatistics is True, the slicer core module Segment Statistics is used instead of numpy.
+        Returns tuple (min, max) with intensity values inside the mask, (0, 0) if the mask is empty. """
+        # Voxels edited in place (arrayFromVolumeModified) only modify the image data, not the node
+        cacheKey = (inputScan.GetID(), inputScan.GetMTime(), inputScan.GetImageData().GetMTime(),
+                    inputLabelMapNode.GetID(), inputLabelMapNode.GetMTime(),
+                    inputLabelMapNode.GetImageData().GetMTime(), useSegmentStatistics)
+        if self.labelStatisticsCache is not None and self.labelStatisticsCache[0] == cacheKey:
+            return self.labelStatisticsCache[1]
+
+        if useSegmentStatistics:
+            statistics = self.computeSegmentStatistics(inputScan, inputLabelMapNode)
+        else:
+            maskArray = slicer.util.arrayFromVolume(inputLabelMapNode)
+            values = slicer.util.arrayFromVolume(inputScan)[maskArray > 0]
+            if values.size == 0:
+                statistics = (0.0, 0.0)
+            else:
+                statistics = (float(values.min()), float(values.max()))
 
-        # Explicitly enable ScalarVolumeSegmentStatistics
-        segStatLogic.getParameterNode().SetParameter("ScalarVolumeSegmentStatisticsPlugin.enabled", str(True))
-        segStatLogic.computeStatistics()
-        stats = segStatLogic.getStatistics()
+        self.labelStatisticsCache = (cacheKey, statistics)
+        return statistics
 
-        # Remove temporary segmentation node
-        slicer.mrmlScene.RemoveNode(segmentationNode)
+    def computeSegmentStatistics(self, inputScan, inputLabelMapNode):
+        """ Use slicer core module to get the min/max intensity value inside the mask.
+        Returns tuple (min, max) with intensity values inside the first segment of the label map. """
+        # Use segment statistics to compute good default parameters for texture modules.
+        import SegmentStatistics
+        # Export lapel map node into a hidden, temporary segmentation node
+        segmentationNode = slicer.vtkMRMLSegmentationNode()
+        segmentationNode.SetHideFromEditors(True)
+        slicer.mrmlScene.AddNode(segmentationNode)
+        try:
+            slicer.modules.segmentations.logic().ImportLabelmapToSegmentationNode(inputLabelMapNode, segmentationNode)
+
+            # Compute statistics (may take time)
+            segStatLogic = SegmentStatistics.SegmentStatisticsLogic()
+            parameterNode = segStatLogic.getParameterNode()
+            # Coalesce the parameter updates into a single Modified event
+            wasModifying = parameterNode.StartModify()
+            try:
+                parameterNode.SetParameter("Segmentation", segmentationNode.GetID())
+                parameterNode.SetParameter("ScalarVolume", inputScan.GetID())
+
+                # Disable all plugins
+                for plugin in segStatLogic.plugins:
+                    pluginName = plugin.__class__.__name__
+                    parameterNode.SetParameter(f"{pluginName}.enabled", str(False))
+
+                # Explicitly enable ScalarVolumeSegmentStatistics
+                parameterNode.SetParameter("ScalarVolumeSegmentStatisticsPlugin.enabled", str(True))
+            finally:
+                parameterNode.EndModify(wasModifying)
+            segStatLogic.computeStatistics()
+            stats = segStatLogic.getStatistics()
+        finally:
+            # Remove temporary segmentation node
+            slicer.mrmlScene.RemoveNode(segmentationNode)
 
         segmentId = stats["SegmentIDs"][0]
         minIntensityValue = stats[segmentId, "ScalarVolumeSegmentStatisticsPlugin.min"]
         maxIntensityValue = stats[segmentId, "ScalarVolumeSegmentStatisticsPlugin.max"]
-
         return minIntensityValue, maxIntensityValue
 
     def computeBinsBasedOnIntensityRange(self, minIntensityValue, maxIntensityValue):
@@ -479,8 +605,9 @@ class BoneTextureLogic(ScriptedLoadableModuleLogic, VTKObservationMixin):
         The minimum number of bins is 100, indepedently of the input.
         Returns integer number of bins.
         """
-        numBins = 100 * int(math.ceil(abs(maxIntensityValue - minIntensityValue)/1000.0))
-        return numBins
+        intensityRange = abs(int(maxIntensityValue) - int(minIntensityValue))
+        numBins = 100 * ((intensityRange + 999) // 1000)
+        return max(numBins, 100)
 
 
     # ************************************************************************ #
@@ -490,21 +617,39 @@ class BoneTextureLogic(ScriptedLoadableModuleLogic, VTKObservationMixin):
     # ----------- Useful functions to access the .ui file elements ----------- #
 
     def get(self, objectName):
-        return self.findWidget(self.interface.widget, objectName)
-
-    def findWidget(self, widget, objectName):
-        if widget.objectName == objectName:
-            return widget
-        else:
-            for w in widget.children():
-                resulting_widget = self.findWidget(w, objectName)
-                if resulting_widget:
-                    return resulting_widget
-            return None
+        if self.widgetIndex is None:
+            self.widgetIndex = self.buildWidgetIndex(self.interface.widget)
+        return self.widgetIndex.get(objectName)
+
+    def buildWidgetIndex(self, rootWidget):
+        """ Walk the widget tree once (breadth first) and map each objectName to its widget.
+        If several widgets share a name, the one closest to the root is kept. """
+        widgetIndex = {}
+        queue = collections.deque([rootWidget])
+        while queue:
+            widget = queue.popleft()
+            widgetIndex.setdefault(widget.objectName, widget)
+            queue.extend(widget.children())
+        return widgetIndex
 
     # ------- Test to ensure that the input data exist and are conform ------- #
 
+    def clearCaches(self):
+        self.labelStatisticsCache = None
+        self.verifiedInputs = None
+
     def inputDataVerification(self, inputScan, inputSegmentation):
+        # Only successful verifications are cached, so that the warnings are shown again for invalid inputs
+        verifiedInputs = tuple((node.GetID(), node.GetMTime()) if node else None
+                               for node in (inputScan, inputSegmentation))
+        if verifiedInputs == self.verifiedInputs:
+            return True
+        if self.checkInputData(inputScan, inputSegmentation):
+            self.verifiedInputs = verifiedInputs
+            return True
+        return False
+
+    def checkInputData(self, inputScan, inputSegmentation):
         if not(inputScan):
             slicer.util.warningDisplay("Please specify an input scan")
             return False
@@ -523,8 +668,13 @@ class BoneTextureLogic(ScriptedLoadableModuleLogic, VTKObservationMixin):
                 return False
         return True
 
+    def isSegmentationEmpty(self, inputSegmentation):
+        """ True if a segmentation is given but has no labeled voxel, so the CLIs would have nothing to compute. """
+        return inputSegmentation is not None and not slicer.util.arrayFromVolume(inputSegmentation).any()
+
     # ---------------- Convert Vector Input to Scalar ---------------------- #
     def convertInputVectorToScalarVolume(self, inputScan, outputScalarVolume, conversionMethod, componentToExtract):
+        import VectorToScalarVolume
         externalLogic = VectorToScalarVolume.VectorToScalarVolumeLogic()
         # externalLogic.run performs the validation of parameters.
         return externalLogic.runWithVariables(inputScan, outputScalarVolume, conversionMethod, componentToExtract)
@@ -546,65 +696,248 @@ class BoneTextureLogic(ScriptedLoadableModuleLogic, VTKObservationMixin):
         if not (computeGLCMFeatures or computeGLRLMFeatures or computeBMFeatures):
             slicer.util.warningDisplay("Please select at least one type of features to compute")
             return
+        if self.isSegmentationEmpty(inputSegmentation):
+            slicer.util.warningDisplay("The input segmentation is empty")
+            return
+
+        # The cropped volumes are shared by all the CLIs launched below
+        croppedNodes = []
+        if self.cropToSegmentation and inputSegmentation is not None:
+            croppedNodes = self.createCroppedInputs(inputScan, inputSegmentation)
+            if croppedNodes:
+                inputScan, inputSegmentation = croppedNodes
+
+        computeFlags = {"GLCM": computeGLCMFeatures, "GLRLM": computeGLRLMFeatures, "BM": computeBMFeatures}
+        valueDicts = {"GLCM": GLCMFeaturesValueDict, "GLRLM": GLRLMFeaturesValueDict, "BM": BMFeaturesValueDict}
+
+        # When several feature sets are requested, a single CLI reads the inputs once and computes them all.
+        # A quantized input is a different volume for each feature set, so it keeps its own CLI.
+        quantizeInputs = {key: bool(computeFlags[key] and quantizable and self.quantizeInput
+                                    and self.canQuantizeInput(valueDicts[key]))
+                          for key, (_, quantizable) in self.FEATURE_JOBS.items()}
+        fuseFeatures = {key: bool(computeFlags[key] and not quantizeInputs[key]) for key in computeFlags}
+        if sum(fuseFeatures.values()) > 1:
+            self.computeAllFeatures(inputScan,
+                                    inputSegmentation,
+                                    fuseFeatures["GLCM"],
+                                    fuseFeatures["GLRLM"],
+                                    fuseFeatures["BM"],
+                                    GLCMFeaturesValueDict,
+                                    GLRLMFeaturesValueDict,
+                                    BMFeaturesValueDict,
+                                    croppedNodes)
+            computeFlags = quantizeInputs
 
         # Create the CLInodes, and observe them for async logic
-        if computeGLCMFeatures:
-            logging.info('Computing GLCM Features ...')
-            _module = slicer.modules.computeglcmfeatures
-            GLCMParameters = dict(GLCMFeaturesValueDict)
-            GLCMParameters["inputVolume"] = inputScan
-            GLCMParameters["inputMask"] = inputSegmentation
-            GLCMNode = slicer.cli.createNode(_module, GLCMParameters)
-            self.addObserver(GLCMNode, slicer.vtkMRMLCommandLineModuleNode().StatusModifiedEvent, self.onGLCMNodeModified)
-            GLCMNode = slicer.cli.run(_module, node=GLCMNode, parameters=GLCMParameters, wait_for_completion=False)
+        for key, (moduleName, _) in self.FEATURE_JOBS.items():
+            if not computeFlags[key]:
+                continue
+            logging.info('Computing %s Features ...', key)
+            _module = getattr(slicer.modules, moduleName)
+            parameters = self.cliParameters(valueDicts[key], inputScan, inputSegmentation)
+            temporaryNodes = list(croppedNodes)
+            if quantizeInputs[key]:
+                temporaryNodes.append(self.useQuantizedScan(parameters, inputScan, valueDicts[key]))
+            cliNode = slicer.cli.createNode(_module, parameters)
+            self.runFeatureCLI(_module, cliNode, parameters, key, temporaryNodes)
+
+    def cliParameters(self, valueDict, inputScan, inputSegmentation, **extraParameters):
+        """ Parameters of a feature CLI: the values of valueDict, the inputs and extraParameters. """
+        return {**valueDict, "inputVolume": inputScan, "inputMask": inputSegmentation, **extraParameters}
+
+    def computeAllFeatures(self,
+                           inputScan,
+                           inputSegmentation,
+                           computeGLCMFeatures,
+                           computeGLRLMFeatures,
+                           computeBMFeatures,
+                           GLCMFeaturesValueDict,
+                           GLRLMFeaturesValueDict,
+                           BMFeaturesValueDict,
+                           temporaryNodes=()):
+        """ Run the selected feature sets in a single ComputeAllFeatures CLI call.
+        The parameters of each set are prefixed with its name (e.g. GLCMBinNumber). """
+        logging.info('Computing %s Features ...', 'All')
+        _module = slicer.modules.computeallfeatures
+        parameters = {"inputVolume": inputScan,
+                      "inputMask": inputSegmentation,
+                      "computeGLCMFeatures": computeGLCMFeatures,
+                      "computeGLRLMFeatures": computeGLRLMFeatures,
+                      "computeBMFeatures": computeBMFeatures}
+        for prefix, valueDict in (("GLCM", GLCMFeaturesValueDict),
+                                  ("GLRLM", GLRLMFeaturesValueDict),
+                                  ("BM", BMFeaturesValueDict)):
+            for key, value in valueDict.items():
+                if key != "neighborhoodRadius":
+                    parameters[prefix + key[0].upper() + key[1:]] = value
+        allFeaturesNode = slicer.cli.createNode(_module, parameters)
+        self.runFeatureCLI(_module, allFeaturesNode, parameters, "All", temporaryNodes)
+
+    def runFeatureCLI(self, module, cliNode, parameters, key, temporaryNodes=()):
+        """ Run the feature CLI asynchronously. Slicer executes asynchronous CLIs one at a time on its
+        processing thread, so CLIs started together run one after the other.
+        The temporaryNodes are removed from the scene once no remaining CLI uses them.
+        Returns a concurrent.futures.Future resolved with cliNode once the CLI is done; the features
+        are stored by storeFeatures, more callbacks can be attached with add_done_callback.
+        A CLI still running for the same key is cancelled. """
+        self.cancelFeatureCLI(key)
+        if temporaryNodes:
+            self.temporaryNodes[cliNode.GetID()] = list(temporaryNodes)
+        if self.readFeaturesFromFile:
+            featuresFile = os.path.join(slicer.app.temporaryPath, "%s_Features.f32" % cliNode.GetID())
+            parameters["outputFeaturesFile"] = featuresFile
+            self.featuresFiles[cliNode.GetID()] = featuresFile
+        future = concurrent.futures.Future()
+        future.add_done_callback(functools.partial(self.storeFeatures, key, cliNode))
+        self.observeFeatureNode(cliNode, key, future)
+        slicer.cli.run(module, node=cliNode, parameters=parameters, wait_for_completion=False)
+        return future
+
+    def cancelFeatureCLI(self, key):
+        """ Ask the feature CLI running for key to stop. Its future is cancelled, which removes its
+        temporary nodes and features file, once the node is no longer busy. """
+        if key not in self.featureObservers:
+            return
+        cliNode, tag, future = self.featureObservers.pop(key)
+        self.cancelledFeatureCLIs[cliNode.GetID()] = (cliNode, tag, future)
+        cliNode.Cancel()
+        if not cliNode.IsBusy():
+            self.onFeatureNodeModified(key, cliNode, None)
 
-        if computeGLRLMFeatures:
-            logging.info('Computing GLRLM Features ...')
-            _module = slicer.modules.computeglrlmfeatures
-            GLRLMParameters = dict(GLRLMFeaturesValueDict)
-            GLRLMParameters["inputVolume"] = inputScan
-            GLRLMParameters["inputMask"] = inputSegmentation
-            GLRLMNode = slicer.cli.createNode(_module, GLRLMParameters)
-            self.addObserver(GLRLMNode, slicer.vtkMRMLCommandLineModuleNode().StatusModifiedEvent, self.onGLRLMNodeModified)
-            # self.GLRLMNodeObserver = GLRLMNode.AddObserver(slicer.vtkMRMLCommandLineModuleNode().StatusModifiedEvent, self.onGLRLMNodeModified)
-            GLRLMNode = slicer.cli.run(_module, node=GLRLMNode, parameters=GLRLMParameters, wait_for_completion=False)
+    def observeFeatureNode(self, cliNode, key, future):
+        """ Observe the status of a feature CLI node with the shared onFeatureNodeModified callback. """
+        tag = cliNode.AddObserver(slicer.vtkMRMLCommandLineModuleNode().StatusModifiedEvent,
+                                  functools.partial(self.onFeatureNodeModified, key))
+        self.featureObservers[key] = (cliNode, tag, future)
 
-        if computeBMFeatures:
-            logging.info('Computing BM Features ...')
-            _module = slicer.modules.computebmfeatures
-            BMParameters = dict(BMFeaturesValueDict)
-            BMParameters["inputVolume"] = inputScan
-            BMParameters["inputMask"] = inputSegmentation
-            BMNode = slicer.cli.createNode(_module, BMParameters)
-            self.addObserver(BMNode, slicer.vtkMRMLCommandLineModuleNode().StatusModifiedEvent, self.onBMNodeModified)
-            BMNode = slicer.cli.run(_module, node=BMNode, parameters=BMParameters, wait_for_completion=False)
-
-    def onGLCMNodeModified(self, cliNode, event):
-        if not cliNode.IsBusy():
-          self.removeObservers(self.onGLCMNodeModified)
-          logging.info('GLCM status: %s' % cliNode.GetStatusString())
-          if cliNode.GetStatusString() == 'Completed':
-            self.featuresGLCM = list(map(float, cliNode.GetParameterValue(2, 0).split(",")))
-            if self.interface is not None:
-                self.interface.onDisplayFeatures()
-
-    def onGLRLMNodeModified(self, cliNode, event):
-        if not cliNode.IsBusy():
-          self.removeObservers(self.onGLRLMNodeModified)
-          logging.info('GLRLM status: %s' % cliNode.GetStatusString())
-          if cliNode.GetStatusString() == 'Completed':
-            self.featuresGLRLM = list(map(float, cliNode.GetParameterValue(2, 0).split(",")))
-            if self.interface is not None:
-                self.interface.onDisplayFeatures()
-
-    def onBMNodeModified(self, cliNode, event):
-        if not cliNode.IsBusy():
-          self.removeObservers(self.onBMNodeModified)
-          logging.info('BM status: %s' % cliNode.GetStatusString())
-          if cliNode.GetStatusString() == 'Completed':
-            self.featuresBM = list(map(float, cliNode.GetParameterValue(2, 0).split(",")))
-            if self.interface is not None:
-                self.interface.onDisplayFeatures()
+    def onFeatureNodeModified(self, key, cliNode, event):
+        """ Resolve the future of the feature CLI once it is no longer busy, or cancel it if the CLI was cancelled. """
+        if cliNode.IsBusy():
+            return
+        if cliNode.GetID() in self.cancelledFeatureCLIs:
+            _, tag, future = self.cancelledFeatureCLIs.pop(cliNode.GetID())
+            cliNode.RemoveObserver(tag)
+            future.cancel()
+            return
+        observedNode, tag, future = self.featureObservers.get(key, (None, None, None))
+        if observedNode is not cliNode:
+            return
+        del self.featureObservers[key]
+        cliNode.RemoveObserver(tag)
+        future.set_result(cliNode)
+
+    def storeFeatures(self, key, cliNode, future):
+        """ Store the output vector(s) of the feature CLI in featuresGLCM, featuresGLRLM or featuresBM. """
+        from BoneTextureLib import FeaturesFile
+        self.removeTemporaryNodes(cliNode)
+        if future.cancelled():
+            featuresFile = self.featuresFiles.pop(cliNode.GetID(), None)
+            if featuresFile is not None and os.path.exists(featuresFile):
+                os.remove(featuresFile)
+            return
+        logging.info('%s status: %s', key, cliNode.GetStatusString())
+        featuresFile = self.featuresFiles.pop(cliNode.GetID(), None)
+        values = None
+        if featuresFile is not None and os.path.exists(featuresFile):
+            if cliNode.GetStatusString() == 'Completed':
+                values = FeaturesFile.readFeaturesFile(featuresFile)
+            os.remove(featuresFile)
+        if cliNode.GetStatusString() != 'Completed':
+            return
+        # (attribute, output vector, number of features) of each feature set computed by the CLI
+        if key == "All":
+            slots = [self.FEATURE_SETS[featureSet] for featureSet in self.FEATURE_SETS
+                     if cliNode.GetParameterAsString("compute%sFeatures" % featureSet) == "true"]
+        else:
+            attributeName, _, numberOfFeatures = self.FEATURE_SETS[key]
+            slots = [(attributeName, "outputVector", numberOfFeatures)]
+        numberOfFeatures = [slot[2] for slot in slots]
+        if values is not None and values.size == sum(numberOfFeatures):
+            for (attributeName, _, _), features in zip(slots, np.split(values, np.cumsum(numberOfFeatures)[:-1])):
+                setattr(self, attributeName, features)
+        else:
+            for attributeName, outputName, _ in slots:
+                features = FeaturesFile.parseOutputVector(cliNode.GetParameterAsString(outputName))
+                if features is None:
+                    logging.warning('%s: the output vector %s is empty', key, outputName)
+                setattr(self, attributeName, features)
+        if self.interface is not None:
+            self.interface.onDisplayFeatures()
+
+    # ------------------- Quantization of the input scan ---------------------- #
+
+    def canQuantizeInput(self, valueDict):
+        """ The quantized scan is stored as uint8, with 255 reserved for out of range voxels. """
+        return (valueDict["binNumber"] < self.OUT_OF_RANGE_BIN
+                and valueDict["pixelIntensityMax"] > valueDict["pixelIntensityMin"])
+
+    def createQuantizedScan(self, inputScan, valueDict):
+        """ Create a hidden uint8 copy of inputScan holding the bin index of each voxel.
+        Voxels outside of the intensity range are set to OUT_OF_RANGE_BIN, so that the filters
+        configured with the range [0, binNumber - 1] keep ignoring them. """
+        from BoneTextureLib import Quantization
+        scanArray = slicer.util.arrayFromVolume(inputScan)
+        pixelIntensityMin = valueDict["pixelIntensityMin"]
+        pixelIntensityMax = valueDict["pixelIntensityMax"]
+        quantizedArray = Quantization.quantize(scanArray, pixelIntensityMin, pixelIntensityMax,
+                                               valueDict["binNumber"]).astype(np.uint8)
+        quantizedArray[(scanArray < pixelIntensityMin) | (scanArray > pixelIntensityMax)] = self.OUT_OF_RANGE_BIN
+
+        quantizedScan = slicer.vtkMRMLScalarVolumeNode()
+        quantizedScan.SetName(slicer.mrmlScene.GetUniqueNameByString(inputScan.GetName() + "_Quantized"))
+        quantizedScan.SetHideFromEditors(True)
+        slicer.mrmlScene.AddNode(quantizedScan)
+        quantizedScan.CopyOrientation(inputScan)
+        slicer.util.updateVolumeFromArray(quantizedScan, quantizedArray)
+        return quantizedScan
+
+    def useQuantizedScan(self, parameters, inputScan, valueDict):
+        """ Replace the input volume of the CLI parameters by a quantized copy of inputScan,
+        with the intensity range set to the bin indices. Returns the quantized scan. """
+        quantizedScan = self.createQuantizedScan(inputScan, valueDict)
+        parameters["inputVolume"] = quantizedScan
+        parameters["pixelIntensityMin"] = 0
+        parameters["pixelIntensityMax"] = valueDict["binNumber"] - 1
+        return quantizedScan
+
+    def removeTemporaryNodes(self, cliNode):
+        for temporaryNode in self.temporaryNodes.pop(cliNode.GetID(), []):
+            if not any(temporaryNode in nodes for nodes in self.temporaryNodes.values()):
+                slicer.mrmlScene.RemoveNode(temporaryNode)
+
+    # ------------- Cropping of the inputs to the segmentation ---------------- #
+
+    def createCroppedInputs(self, inputScan, inputSegmentation, margin=1):
+        """ Create hidden copies of inputScan and inputSegmentation cropped to the bounding box of the
+        labeled voxels, enlarged by margin voxels so that the neighbors of the boundary voxels are kept.
+        Returns [croppedScan, croppedSegmentation], or [] if the crop would not remove any voxel. """
+        maskArray = slicer.util.arrayFromVolume(inputSegmentation)
+        slices = []
+        for axis in range(maskArray.ndim):
+            otherAxes = tuple(a for a in range(maskArray.ndim) if a != axis)
+            indices = np.flatnonzero(maskArray.any(axis=otherAxes))
+            slices.append(slice(max(indices[0] - margin, 0), min(indices[-1] + 1 + margin, maskArray.shape[axis])))
+        slices = tuple(slices)
+        if all(axisSlice.stop - axisSlice.start == size for axisSlice, size in zip(slices, maskArray.shape)):
+            return []
+
+        # Arrays are indexed KJI, the origin of the cropped volumes is the RAS position of the first IJK voxel
+        ijkToRAS = vtk.vtkMatrix4x4()
+        inputScan.GetIJKToRASMatrix(ijkToRAS)
+        origin = ijkToRAS.MultiplyPoint([slices[2].start, slices[1].start, slices[0].start, 1])[:3]
+
+        croppedNodes = []
+        for node, croppedNode in ((inputScan, slicer.vtkMRMLScalarVolumeNode()),
+                                  (inputSegmentation, slicer.vtkMRMLLabelMapVolumeNode())):
+            croppedNode.SetName(slicer.mrmlScene.GetUniqueNameByString(node.GetName() + "_Cropped"))
+            croppedNode.SetHideFromEditors(True)
+            slicer.mrmlScene.AddNode(croppedNode)
+            croppedNode.CopyOrientation(node)
+            croppedNode.SetOrigin(origin)
+            slicer.util.updateVolumeFromArray(croppedNode,
+                                              np.ascontiguousarray(slicer.util.arrayFromVolume(node)[slices]))
+            croppedNodes.append(croppedNode)
+        return croppedNodes
 
     # def computeSingleFeatureSet(self,
     #                            inputScan,
@@ -637,6 +970,9 @@ class BoneTextureLogic(ScriptedLoadableModuleLogic, VTKObservationMixin):
         if not (computeGLCMFeatures or computeGLRLMFeatures or computeBMFeatures):
             slicer.util.warningDisplay("Please select at least one type of features to compute")
             return
+        if self.isSegmentationEmpty(inputSegmentation):
+            slicer.util.warningDisplay("The input segmentation is empty")
+            return
 
         if computeGLCMFeatures:
             self.computeSingleColormap(inputScan,
@@ -665,40 +1001,94 @@ class BoneTextureLogic(ScriptedLoadableModuleLogic, VTKObservationMixin):
                               CLIname,
                               valueDict,
                               outputName):
-        parameters = dict(valueDict)
-        parameters["inputVolume"] = inputScan
-        parameters["inputMask"] = inputSegmentation
+        if (self.useGPU and CLIname.name == "ComputeGLCMFeatureMaps"
+                and self.computeGLCMColormapOnGPU(inputScan, inputSegmentation, valueDict, outputName)):
+            return
+        parameters = self.cliParameters(valueDict, inputScan, inputSegmentation,
+                                        numberOfThreads=self.numberOfThreads,
+                                        outputVolume=self.createColormapVolumeNode(outputName))
+        slicer.cli.run(CLIname,
+                       None,
+                       parameters,
+                       wait_for_completion=False)
+
+    def rainbowColorNodeID(self):
+        """ ID of the Rainbow color node, looked up by name only once. """
+        if self.rainbowID is None or slicer.mrmlScene.GetNodeByID(self.rainbowID) is None:
+            self.rainbowID = slicer.util.getNode('Rainbow').GetID()
+        return self.rainbowID
+
+    def createColormapVolumeNode(self, outputName):
+        # A vtkMRMLVectorVolumeNode would be lighter, but its display node only shows RGB or the magnitude,
+        # while the diffusion weighted display node shows one feature at a time with the Rainbow color table.
         volumeNode = slicer.vtkMRMLDiffusionWeightedVolumeNode()
         slicer.mrmlScene.AddNode(volumeNode)
         displayNode = slicer.vtkMRMLDiffusionWeightedVolumeDisplayNode()
         slicer.mrmlScene.AddNode(displayNode)
-        colorNode = slicer.util.getNode('Rainbow')
-        displayNode.SetAndObserveColorNodeID(colorNode.GetID())
+        displayNode.SetAndObserveColorNodeID(self.rainbowColorNodeID())
         volumeNode.SetAndObserveDisplayNodeID(displayNode.GetID())
         volumeNode.SetName(outputName)
-        parameters["outputVolume"] = volumeNode
-        slicer.cli.run(CLIname,
-                       None,
-                       parameters,
-                       wait_for_completion=False)
+        return volumeNode
+
+    def computeGLCMColormapOnGPU(self,
+                                 inputScan,
+                                 inputSegmentation,
+                                 valueDict,
+                                 outputName):
+        """ Compute the GLCM feature maps with the CUDA backend instead of the computeglcmfeaturemaps CLI.
+        Returns False if the backend cannot be used, so that the caller falls back to the CLI. """
+        from BoneTextureLib import GPUTextureFeatures
+        if inputSegmentation is None:
+            logging.info("The GPU backend requires a segmentation, computing GLCM feature maps on the CPU")
+            return False
+        if valueDict["pixelIntensityMax"] <= valueDict["pixelIntensityMin"]:
+            logging.warning("Empty intensity range for the GPU backend, computing GLCM feature maps on the CPU")
+            return False
+        if not GPUTextureFeatures.isAvailable():
+            logging.info("CuPy or a CUDA device is not available, computing GLCM feature maps on the CPU")
+            return False
+        accumulatorBitWidth = GPUTextureFeatures.accumulatorBitWidthFor(self.accumulatorBitWidth,
+                                                                        valueDict["neighborhoodRadius"])
+        if valueDict["binNumber"] > GPUTextureFeatures.maximumBinNumber(accumulatorBitWidth):
+            logging.warning("Too many bins for the GPU backend, computing GLCM feature maps on the CPU")
+            return False
+
+        logging.info('Computing GLCM feature maps on the GPU ...')
+        featureMap = GPUTextureFeatures.computeGLCMFeatureMap(slicer.util.arrayFromVolume(inputScan),
+                                                              slicer.util.arrayFromVolume(inputSegmentation),
+                                                              valueDict["insideMask"],
+                                                              valueDict["binNumber"],
+                                                              valueDict["pixelIntensityMin"],
+                                                              valueDict["pixelIntensityMax"],
+                                                              valueDict["neighborhoodRadius"],
+                                                              accumulatorBitWidth)
+        volumeNode = self.createColormapVolumeNode(outputName)
+        volumeNode.CopyOrientation(inputScan)
+        slicer.util.updateVolumeFromArray(volumeNode, featureMap)
+        return True
 
     def SaveTableAsCSV(self,
                        table,
                        fileName):
         if fileName is None:
             slicer.util.warningDisplay("Please specify an output file")
+            return
         if (not (fileName.endswith(".csv"))):
             slicer.util.warningDisplay("The output file must be a csv file")
-        file = open(fileName, 'w')
-        cw = csv.writer(file, delimiter=',')
-
-        for j in range(6):
-            row = []
-            for i in range(10):
-                if table.item(i, j):
-                    row.append(table.item(i, j).text())
-            cw.writerow(row)
-        file.close()
+            return
+        # One csv row per table column, empty cells for the missing items
+        item = table.item
+        cells = np.full((table.rowCount, table.columnCount), '', dtype=object)
+        for i in range(table.rowCount):
+            for j in range(table.columnCount):
+                cellItem = item(i, j)
+                if cellItem is not None:
+                    cells[i, j] = cellItem.text()
+        # Serialize in memory, then write the file at once
+        buffer = io.StringIO()
+        csv.writer(buffer, delimiter=',').writerows(cells.T)
+        with open(fileName, 'w', newline='') as file:
+            file.write(buffer.getvalue())
 
 ################################################################################
 ###########################  Bone Texture Test #################################
@@ -0,0 +1,26 @@
+import numpy as np
+
+################################################################################
+############################  Features Output ##################################
+################################################################################
+
+
+def readFeaturesFile(fileName):
+    """ Read the raw little-endian float32 features written by WriteFeaturesFile (include/FeaturesFileWriter.h).
+    Returns a float64 array. """
+    return np.fromfile(fileName, dtype='<f4').astype(np.float64)
+
+
+def parseOutputVector(text):
+    """ Parse the comma separated output vector of a feature CLI.
+    Returns a float64 array, or None if the output vector is empty. """
+    text = text.strip()
+    if not text:
+        return None
+    return np.array(text.split(","), dtype=np.float64)
+
+
+def formatFeature(value):
+    """ Text of a feature value as the CLIs write it in their output vectors (std::ostream default
+    precision, i.e. %g), so the features table reads the same whichever output the features came from. """
+    return '%g' % value
@@ -0,0 +1,398 @@
+import logging
+
+import numpy as np
+
+from .Quantization import quantize
+
+# CuPy is an optional dependency, the GPU path is only used when it is installed
+# and a CUDA device is available.
+try:
+    import cupy
+except ImportError:
+    cupy = None
+
+################################################################################
+########################  GPU Co-occurrence Features ###########################
+################################################################################
+
+# Number of features computed for each voxel, in the order of the
+# itkCoocurrenceTextureFeaturesImageFilter output (see BoneTextureWidget.CFeatures).
+NUMBER_OF_GLCM_FEATURES = 8
+
+# The co-occurrence matrix of a voxel is accumulated in shared memory
+# (binNumber^2 counters), which limits the number of bins to fit in 48 KB.
+MAXIMUM_BIN_NUMBER = 100
+# Same limit with 16-bit counters, packed two per 32-bit word
+MAXIMUM_BIN_NUMBER_16_BIT = 150
+
+_GLCM_KERNEL_SOURCE = r'''
+// Maximum number of offsets: the 13 unique unit directions of a 3D neighborhood
+#define MAXIMUM_NUMBER_OF_OFFSETS 13
+
+// The co-occurrence counts are 32-bit, or 16-bit packed two per 32-bit word when
+// PACKED_COUNTS is defined. Packed updates are done with 32-bit modular arithmetic on
+// the whole word, so they are exact as long as every final count fits in 16 bits.
+#ifdef PACKED_COUNTS
+#define COUNT_WORDS(n) (((n) + 1) / 2)
+__device__ __forceinline__ void addCount(unsigned int* glcm, const int index, const int delta)
+{
+    atomicAdd(&glcm[index >> 1], (unsigned int)delta << (16 * (index & 1)));
+}
+__device__ __forceinline__ unsigned int getCount(const unsigned int* glcm, const int index)
+{
+    return (glcm[index >> 1] >> (16 * (index & 1))) & 0xFFFFu;
+}
+#else
+#define COUNT_WORDS(n) (n)
+__device__ __forceinline__ void addCount(unsigned int* glcm, const int index, const int delta)
+{
+    atomicAdd(&glcm[index], (unsigned int)delta);
+}
+__device__ __forceinline__ unsigned int getCount(const unsigned int* glcm, const int index)
+{
+    return glcm[index];
+}
+#endif
+
+// Count the pair (p, q = p + offset) in the neighborhood of the voxel (x, y, z) if both
+// voxels are inside the image, the mask and the intensity range, and inside the neighborhood:
+// [lo, hi] along x, the (2r+1)^2 square around (y, z) in yz. As in the ITK filter, each pair is
+// counted once, in the direction of its offset.
+__device__ __forceinline__ void countPair(unsigned int* glcm,
+                                          const int* bins,
+                                          const int px, const int py, const int pz,
+                                          const int qx, const int qy, const int qz,
+                                          const int lo, const int hi, const int y, const int z,
+                                          const int sizeX, const int sizeY, const int sizeZ,
+                                          const int radius,
+                                          const int Ng,
+                                          const int sign)
+{
+    if (px < lo || px > hi || qx < lo || qx > hi
+        || py < y - radius || py > y + radius || pz < z - radius || pz > z + radius
+        || qy < y - radius || qy > y + radius || qz < z - radius || qz > z + radius)
+    {
+        return;
+    }
+    if (px < 0 || py < 0 || pz < 0 || px >= sizeX || py >= sizeY || pz >= sizeZ
+        || qx < 0 || qy < 0 || qz < 0 || qx >= sizeX || qy >= sizeY || qz >= sizeZ)
+    {
+        return;
+    }
+    const int a = bins[((long long)pz * sizeY + py) * sizeX + px];
+    const int b = bins[((long long)qz * sizeY + qy) * sizeX + qx];
+    if (a < 0 || b < 0)
+    {
+        return;
+    }
+    // Counts are unsigned: a removal processed before the matching addition
+    // wraps around temporarily, the counts are exact once the column update is done.
+    addCount(glcm, a * Ng + b, sign);
+}
+
+// Add (sign > 0) or remove (sign < 0) the co-occurrences of the neighborhood [lo, hi] x (y, z)
+// that have at least one voxel in the yz-column at abscissa px.
+__device__ void accumulateColumn(unsigned int* glcm,
+                                 const int* bins,
+                                 const int* offsets,
+                                 const int numberOfOffsets,
+                                 const int px, const int lo, const int hi, const int y, const int z,
+                                 const int sizeX, const int sizeY, const int sizeZ,
+                                 const int radius,
+                                 const int Ng,
+                                 const int sign)
+{
+    if (px < 0 || px >= sizeX)
+    {
+        return;
+    }
+    const int width = 2 * radius + 1;
+    for (int n = threadIdx.x; n < width * width; n += blockDim.x)
+    {
+        const int py = y + n % width - radius;
+        const int pz = z + n / width - radius;
+        for (int o = 0; o < numberOfOffsets; ++o)
+        {
+            const int dx = offsets[3 * o];
+            const int dy = offsets[3 * o + 1];
+            const int dz = offsets[3 * o + 2];
+            // The column voxel first in the pair...
+            countPair(glcm, bins, px, py, pz, px + dx, py + dy, pz + dz,
+                      lo, hi, y, z, sizeX, sizeY, sizeZ, radius, Ng, sign);
+            // ...or second, when the first voxel is in another column
+            if (dx != 0)
+            {
+                countPair(glcm, bins, px - dx, py - dy, pz - dz, px, py, pz,
+                          lo, hi, y, z, sizeX, sizeY, sizeZ, radius, Ng, sign);
+            }
+        }
+    }
+}
+
+// Haralick features of a co-occurrence matrix, in the order of the ITK filter output.
+__device__ void computeFeatures(const unsigned int* glcm,
+                                double* marginalSums,
+                                const int Ng,
+                                float* voxelFeatures)
+{
+    double total = 0.0;
+    for (int i = 0; i < Ng * Ng; ++i)
+    {
+        total += getCount(glcm, i);
+    }
+    if (total == 0.0)
+    {
+        for (int f = 0; f < 8; ++f)
+        {
+            voxelFeatures[f] = 0.0f;
+        }
+        return;
+    }
+
+    double pixelMean = 0.0;
+    for (int a = 0; a < Ng; ++a)
+    {
+        double rowSum = 0.0;
+        for (int b = 0; b < Ng; ++b)
+        {
+            const double frequency = getCount(glcm, a * Ng + b) / total;
+            rowSum += frequency;
+            pixelMean += a * frequency;
+        }
+        marginalSums[a] = rowSum;
+    }
+    const double marginalMean = 1.0 / Ng;
+    double marginalDevSquared = 0.0;
+    double pixelVariance = 0.0;
+    for (int a = 0; a < Ng; ++a)
+    {
+        marginalDevSquared += (marginalSums[a] - marginalMean) * (marginalSums[a] - marginalMean);
+        pixelVariance += (a - pixelMean) * (a - pixelMean) * marginalSums[a];
+    }
+    marginalDevSquared /= Ng;
+    double pixelVarianceSquared = pixelVariance * pixelVariance;
+    if (pixelVarianceSquared == 0.0)
+    {
+        pixelVarianceSquared = 1.0;
+    }
+
+    double energy = 0.0, entropy = 0.0, correlation = 0.0, inverseDifferenceMoment = 0.0;
+    double inertia = 0.0, clusterShade = 0.0, clusterProminence = 0.0, haralickCorrelation = 0.0;
+    for (int a = 0; a < Ng; ++a)
+    {
+        for (int b = 0; b < Ng; ++b)
+        {
+            const double frequency = getCount(glcm, a * Ng + b) / total;
+            if (frequency == 0.0)
+            {
+                continue;
+            }
+            const double sum = (a - pixelMean) + (b - pixelMean);
+            energy += frequency * frequency;
+            entropy -= frequency > 0.0001 ? frequency * log2(frequency) : 0.0;
+            correlation += (a - pixelMean) * (b - pixelMean) * frequency / pixelVarianceSquared;
+            inverseDifferenceMoment += frequency / (1.0 + (a - b) * (a - b));
+            inertia += (a - b) * (a - b) * frequency;
+            clusterShade += sum * sum * sum * frequency;
+            clusterProminence += sum * sum * sum * sum * frequency;
+            haralickCorrelation += a * b * frequency;
+        }
+    }
+    if (marginalDevSquared == 0.0)
+    {
+        haralickCorrelation = 0.0;
+    }
+    else
+    {
+        haralickCorrelation = (haralickCorrelation - marginalMean * marginalMean) / marginalDevSquared;
+    }
+
+    voxelFeatures[0] = energy;
+    voxelFeatures[1] = entropy;
+    voxelFeatures[2] = correlation;
+    voxelFeatures[3] = inverseDifferenceMoment;
+    voxelFeatures[4] = inertia;
+    voxelFeatures[5] = clusterShade;
+    voxelFeatures[6] = clusterProminence;
+    voxelFeatures[7] = haralickCorrelation;
+}
+
+// One block per image row (y, z): the co-occurrence matrix is built once around the
+// first masked voxel of the row, then slid along x by removing the pairs touching the
+// trailing yz-column and adding the pairs touching the leading one, so each step touches
+// (2r+1)^2 voxels instead of (2r+1)^3.
+extern "C" __global__
+void coocurrenceFeatures(const int* bins,
+                         const unsigned char* mask,
+                         const long long* rowIndices,
+                         const int* offsets,
+                         const int numberOfOffsets,
+                         const int sizeX, const int sizeY, const int sizeZ,
+                         const int radius,
+                         const int Ng,
+                         float* features)
+{
+    // Ng * Ng co-occurrence counts followed by Ng marginal sums
+    extern __shared__ unsigned int glcm[];
+    const int countWords = COUNT_WORDS(Ng * Ng);
+    double* marginalSums = (double*)&glcm[countWords + countWords % 2];
+    __shared__ int maskedRange[2];
+    // The offsets are read for every neighborhood pixel: keep them in shared memory
+    __shared__ int sharedOffsets[3 * MAXIMUM_NUMBER_OF_OFFSETS];
+    for (int i = threadIdx.x; i < 3 * numberOfOffsets; i += blockDim.x)
+    {
+        sharedOffsets[i] = offsets[i];
+    }
+
+    const long long row = rowIndices[blockIdx.x];
+    const int y = row % sizeY;
+    const int z = row / sizeY;
+    const long long rowStart = row * sizeX;
+
+    if (threadIdx.x == 0)
+    {
+        maskedRange[0] = -1;
+        for (int x = 0; x < sizeX; ++x)
+        {
+            if (mask[rowStart + x])
+            {
+                if (maskedRange[0] < 0)
+                {
+                    maskedRange[0] = x;
+                }
+                maskedRange[1] = x;
+            }
+        }
+    }
+    for (int i = threadIdx.x; i < countWords; i += blockDim.x)
+    {
+        glcm[i] = 0;
+    }
+    __syncthreads();
+
+    const int xFirst = maskedRange[0];
+    const int xLast = maskedRange[1];
+    if (xFirst < 0)
+    {
+        return;
+    }
+    // Each pair is added with the column of its last voxel along x
+    for (int px = xFirst - radius; px <= xFirst + radius; ++px)
+    {
+        accumulateColumn(glcm, bins, sharedOffsets, numberOfOffsets, px, xFirst - radius, px, y, z,
+                         sizeX, sizeY, sizeZ, radius, Ng, 1);
+    }
+    __syncthreads();
+
+    for (int x = xFirst; x <= xLast; ++x)
+    {
+        if (x > xFirst)
+        {
+            accumulateColumn(glcm, bins, sharedOffsets, numberOfOffsets, x - radius - 1, x - radius - 1, x + radius - 1, y, z,
+                             sizeX, sizeY, sizeZ, radius, Ng, -1);
+            accumulateColumn(glcm, bins, sharedOffsets, numberOfOffsets, x + radius, x - radius, x + radius, y, z,
+                             sizeX, sizeY, sizeZ, radius, Ng, 1);
+            __syncthreads();
+        }
+        if (threadIdx.x == 0 && mask[rowStart + x])
+        {
+            computeFeatures(glcm, marginalSums, Ng, features + (rowStart + x) * 8);
+        }
+        __syncthreads();
+    }
+}
+'''
+
+# Compiled kernels, keyed by accumulator bit width
+_glcmKernels = {}
+
+
+def isAvailable():
+    """ Return True if CuPy is installed and a CUDA device can be used. """
+    if cupy is None:
+        return False
+    try:
+        return cupy.cuda.runtime.getDeviceCount() > 0
+    except cupy.cuda.runtime.CUDARuntimeError:
+        return False
+
+
+def accumulatorBitWidthFor(accumulatorBitWidth, neighborhoodRadius):
+    """ Bit width of the co-occurrence counters actually used: 16 only if requested and if no count can
+    exceed 65535, i.e. 13 co-occurrences per voxel of the (2r+1)^3 neighborhood; 32 otherwise. """
+    if accumulatorBitWidth == 16 and 13 * (2 * neighborhoodRadius + 1) ** 3 <= 0xFFFF:
+        return 16
+    return 32
+
+
+def maximumBinNumber(accumulatorBitWidth=32):
+    """ Largest number of bins whose co-occurrence matrix fits in shared memory. """
+    return MAXIMUM_BIN_NUMBER_16_BIT if accumulatorBitWidth == 16 else MAXIMUM_BIN_NUMBER
+
+
+def coocurrenceOffsets():
+    """ The 13 unique unit offsets of a 3D neighborhood, as (dx, dy, dz) rows.
+    As in the ITK filter, each (voxel, voxel + offset) pair is counted once, in that order. """
+    return _COOCURRENCE_OFFSETS
+
+
+# Integer offsets are materialized once, the kernel never derives them from angles
+_COOCURRENCE_OFFSETS = np.asarray([(dx, dy, dz)
+                                   for dz in (-1, 0, 1) for dy in (-1, 0, 1) for dx in (-1, 0, 1)
+                                   if (dz, dy, dx) > (0, 0, 0)], dtype=np.int32)
+_COOCURRENCE_OFFSETS.setflags(write=False)
+
+
+def computeGLCMFeatureMap(scanArray,
+                          maskArray,
+                          insideMask,
+                          binNumber,
+                          pixelIntensityMin,
+                          pixelIntensityMax,
+                          neighborhoodRadius,
+                          accumulatorBitWidth=16):
+    """ Compute the co-occurrence features of every voxel of the mask on the GPU.
+    One CUDA block slides the co-occurrence matrix of the neighborhood along one image row.
+    The counts are 16-bit when accumulatorBitWidth is 16 and the neighborhood is small enough
+    (see accumulatorBitWidthFor), which halves the shared memory used by each block.
+    The co-occurrences are counted as in itkCoocurrenceTextureFeaturesImageFilter (ComputeGLCMFeatureMaps):
+    only pairs with both voxels in the neighborhood, the mask, the image and the intensity range.
+    Unlike the ITK filter, the Haralick correlation is 0 instead of a division by zero when all
+    the marginal sums are equal.
+    The arrays are indexed (k, j, i), as returned by slicer.util.arrayFromVolume.
+    Returns a float32 array of shape scanArray.shape + (8,), voxels outside the mask are 0. """
+    if not isAvailable():
+        raise RuntimeError("GPU texture features require CuPy and a CUDA device")
+    accumulatorBitWidth = accumulatorBitWidthFor(accumulatorBitWidth, neighborhoodRadius)
+    if binNumber > maximumBinNumber(accumulatorBitWidth):
+        raise ValueError("At most %d bins are supported on the GPU" % maximumBinNumber(accumulatorBitWidth))
+    if accumulatorBitWidth not in _glcmKernels:
+        options = ('-DPACKED_COUNTS',) if accumulatorBitWidth == 16 else ()
+        _glcmKernels[accumulatorBitWidth] = cupy.RawKernel(_GLCM_KERNEL_SOURCE, 'coocurrenceFeatures',
+                                                           options=options)
+
+    scan = cupy.asarray(scanArray, dtype=cupy.float64)
+    mask = cupy.asarray(maskArray) == insideMask
+    # Bin index of each voxel, -1 for voxels outside of the mask or the intensity range
+    bins = quantize(scan, pixelIntensityMin, pixelIntensityMax, binNumber, xp=cupy)
+    bins[~(mask & (scan >= pixelIntensityMin) & (scan <= pixelIntensityMax))] = -1
+
+    sizeZ, sizeY, sizeX = scanArray.shape
+    # Only the rows crossing the mask are processed
+    rowIndices = cupy.flatnonzero(mask.reshape(sizeZ * sizeY, sizeX).any(axis=1)).astype(cupy.int64)
+    offsets = cupy.asarray(coocurrenceOffsets())
+    featureMap = cupy.zeros(scanArray.shape + (NUMBER_OF_GLCM_FEATURES,), dtype=cupy.float32)
+    logging.debug("GLCM features on GPU: %d rows, %d bins, %d-bit counts",
+                  rowIndices.size, binNumber, accumulatorBitWidth)
+    if rowIndices.size > 0:
+        countWords = binNumber * binNumber
+        if accumulatorBitWidth == 16:
+            countWords = (countWords + 1) // 2
+        sharedMemory = (countWords + countWords % 2) * 4 + binNumber * 8
+        glcmKernel = _glcmKernels[accumulatorBitWidth]
+        glcmKernel((int(rowIndices.size),), (128,),
+                   (bins, mask.astype(cupy.uint8), rowIndices, offsets, np.int32(len(offsets)),
+                    np.int32(sizeX), np.int32(sizeY), np.int32(sizeZ),
+                    np.int32(neighborhoodRadius), np.int32(binNumber), featureMap),
+                   shared_mem=sharedMemory)
+    return cupy.asnumpy(featureMap)
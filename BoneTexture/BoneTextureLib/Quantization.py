@@ -0,0 +1,19 @@
+import numpy as np
+
+################################################################################
+##########################  Intensity Quantization #############################
+################################################################################
+
+
+def quantize(values, pixelIntensityMin, pixelIntensityMax, binNumber, xp=np):
+    """ Map intensities to bin indices 0..binNumber-1, the way the texture filters bin their histograms:
+    binNumber bins of equal width over [pixelIntensityMin, pixelIntensityMax + 1).
+    Values outside [pixelIntensityMin, pixelIntensityMax] are clipped to the first/last bin.
+    xp is the array module of values (numpy, or cupy for device arrays).
+    Returns an int32 array of the same shape as values. """
+    if pixelIntensityMax <= pixelIntensityMin:
+        raise ValueError("The maximum intensity must be greater than the minimum intensity")
+    bins = xp.floor((xp.asarray(values, dtype=xp.float64) - pixelIntensityMin)
+                    * binNumber / (pixelIntensityMax - pixelIntensityMin + 1))
+    return xp.clip(bins, 0, binNumber - 1).astype(xp.int32)
+
@@ -0,0 +1,188 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from BoneTextureLib import FeaturesFile
+from BoneTextureLib import GPUTextureFeatures
+from BoneTextureLib.Quantization import quantize
+
+################################################################################
+##########################  Bone Texture Lib Test ##############################
+################################################################################
+
+
+def referenceBins(scan, mask, pixelIntensityMin, pixelIntensityMax, binNumber):
+    """ Bin index of each voxel, -1 for voxels outside of the mask or the intensity range. """
+    bins = quantize(scan, pixelIntensityMin, pixelIntensityMax, binNumber, xp=np)
+    bins[~(mask & (scan >= pixelIntensityMin) & (scan <= pixelIntensityMax))] = -1
+    return bins
+
+
+def referenceGLCM(bins, center, radius, binNumber):
+    """ Co-occurrence matrix of the neighborhood of the voxel center (k, j, i), counted as in
+    itkCoocurrenceTextureFeaturesImageFilter: each (voxel, voxel + offset) pair once, both voxels
+    inside the neighborhood and the image, voxels with a negative bin index ignored. """
+    window = bins[tuple(slice(max(c - radius, 0), c + radius + 1) for c in center)]
+    sizeZ, sizeY, sizeX = window.shape
+    glcm = np.zeros(binNumber * binNumber, dtype=np.int64)
+    for dx, dy, dz in GPUTextureFeatures.coocurrenceOffsets():
+        first = window[max(0, -dz):sizeZ - max(0, dz), max(0, -dy):sizeY - max(0, dy), max(0, -dx):sizeX - max(0, dx)]
+        second = window[max(0, dz):sizeZ + min(0, dz), max(0, dy):sizeY + min(0, dy), max(0, dx):sizeX + min(0, dx)]
+        valid = (first >= 0) & (second >= 0)
+        glcm += np.bincount(first[valid] * binNumber + second[valid], minlength=binNumber * binNumber)
+    return glcm.reshape(binNumber, binNumber)
+
+
+def referenceFeatures(glcm):
+    """ The 8 features of itkCoocurrenceTextureFeaturesImageFilter for one co-occurrence matrix. """
+    total = glcm.sum()
+    if total == 0:
+        return np.zeros(GPUTextureFeatures.NUMBER_OF_GLCM_FEATURES)
+    frequency = glcm / total
+    a, b = np.indices(glcm.shape)
+    pixelMean = (a * frequency).sum()
+    marginalSums = frequency.sum(axis=1)
+    marginalMean = marginalSums.mean()
+    marginalDevSquared = ((marginalSums - marginalMean) ** 2).mean()
+    pixelVarianceSquared = ((a - pixelMean) ** 2 * frequency).sum() ** 2 or 1.0
+    entropyFrequency = frequency[frequency > 0.0001]
+    clusterSum = (a - pixelMean) + (b - pixelMean)
+    haralickCorrelation = 0.0
+    if marginalDevSquared != 0:
+        haralickCorrelation = ((a * b * frequency).sum() - marginalMean * marginalMean) / marginalDevSquared
+    return np.array([(frequency ** 2).sum(),
+                     -(entropyFrequency * np.log2(entropyFrequency)).sum(),
+                     ((a - pixelMean) * (b - pixelMean) * frequency).sum() / pixelVarianceSquared,
+                     (frequency / (1.0 + (a - b) ** 2)).sum(),
+                     ((a - b) ** 2 * frequency).sum(),
+                     (clusterSum ** 3 * frequency).sum(),
+                     (clusterSum ** 4 * frequency).sum(),
+                     haralickCorrelation])
+
+
+def referenceGLCMFeatureMap(scan, maskArray, insideMask, binNumber, pixelIntensityMin, pixelIntensityMax, radius):
+    """ Feature map of ComputeGLCMFeatureMaps computed voxel by voxel, 0 outside of the mask. """
+    mask = maskArray == insideMask
+    bins = referenceBins(scan, mask, pixelIntensityMin, pixelIntensityMax, binNumber)
+    featureMap = np.zeros(scan.shape + (GPUTextureFeatures.NUMBER_OF_GLCM_FEATURES,))
+    for center in zip(*np.nonzero(mask)):
+        featureMap[center] = referenceFeatures(referenceGLCM(bins, center, radius, binNumber))
+    return featureMap
+
+
+def randomInputs(shape=(5, 6, 9), seed=0):
+    rng = np.random.default_rng(seed)
+    scan = rng.integers(-50, 1100, size=shape).astype(np.int16)
+    maskArray = (rng.random(shape) < 0.8).astype(np.uint8)
+    maskArray[0, 0, :3] = 2
+    return scan, maskArray
+
+
+def isSlicerAvailable():
+    try:
+        import slicer
+    except ImportError:
+        return False
+    return hasattr(slicer.modules, "computeglcmfeaturemaps")
+
+
+class BoneTextureLibTest(unittest.TestCase):
+
+    def test_quantize(self):
+        # 10 bins of width 10.1 over [0, 101)
+        values = np.array([-5, 0, 10, 20, 55, 99, 100, 250])
+        np.testing.assert_array_equal(quantize(values, 0, 100, 10, xp=np), [0, 0, 0, 1, 5, 9, 9, 9])
+        self.assertEqual(quantize(values, 0, 100, 10, xp=np).dtype, np.int32)
+
+    def test_quantizedInputKeepsBins(self):
+        # The CLIs bin the quantized scan over [0, binNumber - 1], which must give back the bin indices
+        rng = np.random.default_rng(1)
+        scan = rng.integers(-200, 3000, size=(6, 7, 8))
+        for pixelIntensityMin, pixelIntensityMax, binNumber in ((0, 100, 10), (-200, 2999, 32), (17, 1500, 100)):
+            bins = quantize(scan, pixelIntensityMin, pixelIntensityMax, binNumber, xp=np)
+            np.testing.assert_array_equal(quantize(bins, 0, binNumber - 1, binNumber, xp=np), bins)
+
+    def test_quantizeEmptyRange(self):
+        with self.assertRaises(ValueError):
+            quantize(np.zeros(3), 10, 10, 4, xp=np)
+
+    def test_referenceGLCMKeepsPairsInsideNeighborhood(self):
+        bins = np.arange(5, dtype=np.int32).reshape(1, 1, 5)
+        glcm = referenceGLCM(bins, (0, 0, 2), 1, 5)
+        # Only the pairs (1, 2) and (2, 3) have both voxels in the neighborhood [1, 3]
+        expected = np.zeros((5, 5), dtype=np.int64)
+        expected[1, 2] = expected[2, 3] = 1
+        np.testing.assert_array_equal(glcm, expected)
+
+    def test_referenceFeaturesOfUniformNeighborhood(self):
+        bins = np.full((3, 3, 3), 2, dtype=np.int32)
+        glcm = referenceGLCM(bins, (1, 1, 1), 1, 4)
+        # 3 * 18 + 6 * 12 + 4 * 8 pairs along the axes, the face and the corner diagonals
+        self.assertEqual(glcm[2, 2], 158)
+        self.assertEqual(glcm.sum(), 158)
+        energy, entropy, correlation, inverseDifferenceMoment, inertia, clusterShade, clusterProminence, _ = \
+            referenceFeatures(glcm)
+        self.assertEqual((energy, entropy, correlation, inverseDifferenceMoment), (1.0, 0.0, 0.0, 1.0))
+        self.assertEqual((inertia, clusterShade, clusterProminence), (0.0, 0.0, 0.0))
+
+    @unittest.skipUnless(GPUTextureFeatures.isAvailable(), "CuPy and a CUDA device are required")
+    def test_gpuFeatureMapMatchesReference(self):
+        scan, maskArray = randomInputs()
+        for accumulatorBitWidth, binNumber, radius in ((16, 8, 1), (32, 8, 2),
+                                                       (16, GPUTextureFeatures.maximumBinNumber(16), 1),
+                                                       (32, GPUTextureFeatures.maximumBinNumber(32), 1)):
+            expected = referenceGLCMFeatureMap(scan, maskArray, 1, binNumber, 0, 1000, radius)
+            featureMap = GPUTextureFeatures.computeGLCMFeatureMap(scan, maskArray, 1, binNumber, 0, 1000,
+                                                                  radius, accumulatorBitWidth)
+            np.testing.assert_allclose(featureMap, expected, rtol=1e-4, atol=1e-5)
+
+    @unittest.skipUnless(isSlicerAvailable(), "The ComputeGLCMFeatureMaps CLI is only available in Slicer")
+    def test_cliFeatureMapMatchesReference(self):
+        import slicer
+        scan, maskArray = randomInputs()
+        binNumber, radius = 8, 1
+        scanNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLScalarVolumeNode")
+        slicer.util.updateVolumeFromArray(scanNode, scan)
+        maskNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLLabelMapVolumeNode")
+        slicer.util.updateVolumeFromArray(maskNode, maskArray)
+        outputNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLVectorVolumeNode")
+        try:
+            cliNode = slicer.cli.runSync(slicer.modules.computeglcmfeaturemaps, None,
+                                         {"inputVolume": scanNode, "inputMask": maskNode, "outputVolume": outputNode,
+                                          "insideMask": 1, "binNumber": binNumber, "neighborhoodRadius": radius,
+                                          "pixelIntensityMin": 0, "pixelIntensityMax": 1000})
+            slicer.mrmlScene.RemoveNode(cliNode)
+            featureMap = slicer.util.arrayFromVolume(outputNode)
+            expected = referenceGLCMFeatureMap(scan, maskArray, 1, binNumber, 0, 1000, radius)
+            np.testing.assert_allclose(featureMap, expected, rtol=1e-4, atol=1e-5)
+        finally:
+            for node in (scanNode, maskNode, outputNode):
+                slicer.mrmlScene.RemoveNode(node)
+
+    def test_featuresFileDisplaysAsOutputVector(self):
+        # The CLIs write the double feature means with std::ostream (%g) to the output vector,
+        # and as float32 to the features file
+        means = np.array([0.1, 1 / 3, 12345.678, 1e-5, 2.5e8, -0.75, 0.0])
+        outputVector = ",".join('%g' % mean for mean in means)
+        with tempfile.TemporaryDirectory() as directory:
+            fileName = os.path.join(directory, "Features.f32")
+            means.astype('<f4').tofile(fileName)
+            fromFile = FeaturesFile.readFeaturesFile(fileName)
+        fromText = FeaturesFile.parseOutputVector(outputVector)
+        self.assertEqual([FeaturesFile.formatFeature(value) for value in fromFile], outputVector.split(","))
+        self.assertEqual([FeaturesFile.formatFeature(value) for value in fromText], outputVector.split(","))
+
+    def test_parseEmptyOutputVector(self):
+        self.assertIsNone(FeaturesFile.parseOutputVector(" \n"))
+
+    def test_accumulatorBitWidthFor(self):
+        self.assertEqual(GPUTextureFeatures.accumulatorBitWidthFor(16, 1), 16)
+        self.assertEqual(GPUTextureFeatures.accumulatorBitWidthFor(16, 8), 16)
+        self.assertEqual(GPUTextureFeatures.accumulatorBitWidthFor(16, 9), 32)
+        self.assertEqual(GPUTextureFeatures.accumulatorBitWidthFor(32, 1), 32)
+
+
+if __name__ == '__main__':
+    unittest.main()
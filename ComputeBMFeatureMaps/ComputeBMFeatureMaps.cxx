@@ -76,6 +76,16 @@ int DoIt( int argc, char * argv[] )
   hood.SetRadius(neighborhoodRadius);
   filter->SetNeighborhoodRadius(hood.GetRadius());
   filter->SetThreshold( threshold );
+  // Only this filter is limited: the CLI may run inside the Slicer process,
+  // where a global default would apply to every later ITK filter.
+  if( numberOfThreads > 0 )
+  {
+#if ITK_VERSION_MAJOR >= 5
+    filter->SetNumberOfWorkUnits( numberOfThreads );
+#else
+    filter->SetNumberOfThreads( numberOfThreads );
+#endif
+  }
   filter->Update();
 
   typedef itk::ReplaceFeatureMapNanInfImageFilter<OutputImageType> PostProcessingFilterType;
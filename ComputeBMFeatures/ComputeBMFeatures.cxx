@@ -36,6 +36,8 @@
 
 #include "itkPluginUtilities.h"
 
+#include "FeaturesFileWriter.h"
+
 #include "ComputeBMFeaturesCLP.h"
 
 namespace
@@ -84,6 +86,17 @@ int DoIt( int argc, char * argv[] )
   rts<<"TbN = "<< filter->GetTbN() << std::endl;
   rts<<"BSBV = "<< filter->GetBSBV() << std::endl;
 
+  if(outputFeaturesFile != "")
+  {
+    std::vector<float> features;
+    features.push_back(filter->GetBVTV());
+    features.push_back(filter->GetTbTh());
+    features.push_back(filter->GetTbSp());
+    features.push_back(filter->GetTbN());
+    features.push_back(filter->GetBSBV());
+    WriteFeaturesFile(outputFeaturesFile, features);
+  }
+
   return EXIT_SUCCESS;
 }
 
@@ -78,6 +78,16 @@ int DoIt( int argc, char * argv[] )
   filter->SetNeighborhoodRadius(hood.GetRadius());
   filter->SetHistogramMinimum( pixelIntensityMin );
   filter->SetHistogramMaximum( pixelIntensityMax );
+  // Only this filter is limited: the CLI may run inside the Slicer process,
+  // where a global default would apply to every later ITK filter.
+  if( numberOfThreads > 0 )
+  {
+#if ITK_VERSION_MAJOR >= 5
+    filter->SetNumberOfWorkUnits( numberOfThreads );
+#else
+    filter->SetNumberOfThreads( numberOfThreads );
+#endif
+  }
   filter->Update();
 
   itk::MetaDataDictionary dictionary;
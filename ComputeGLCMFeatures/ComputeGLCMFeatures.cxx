@@ -36,6 +36,8 @@
 
 #include "itkPluginUtilities.h"
 
+#include "FeaturesFileWriter.h"
+
 #include "ComputeGLCMFeaturesCLP.h"
 
 namespace
@@ -100,6 +102,16 @@ int DoIt( int argc, char * argv[] )
   }
   rts << std::endl;
 
+  if(outputFeaturesFile != "")
+  {
+    std::vector<float> features;
+    for(mIt = meanVector->Begin(); mIt != meanVector->End(); mIt++)
+    {
+      features.push_back(mIt.Value());
+    }
+    WriteFeaturesFile(outputFeaturesFile, features);
+  }
+
   mIt = meanVector->Begin();
 
   rts<<"Energy = "<< mIt.Value() << std::endl;
@@ -0,0 +1,38 @@
+/*=========================================================================
+ *
+ *  Copyright Insight Software Consortium
+ *
+ *  Licensed under the Apache License, Version 2.0 (the "License");
+ *  you may not use this file except in compliance with the License.
+ *  You may obtain a copy of the License at
+ *
+ *         http://www.apache.org/licenses/LICENSE-2.0.txt
+ *
+ *  Unless required by applicable law or agreed to in writing, software
+ *  distributed under the License is distributed on an "AS IS" BASIS,
+ *  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ *  See the License for the specific language governing permissions and
+ *  limitations under the License.
+ *
+ *=========================================================================*/
+
+#ifndef FeaturesFileWriter_h
+#define FeaturesFileWriter_h
+
+#include "itkByteSwapper.h"
+
+#include <fstream>
+#include <string>
+#include <vector>
+
+// Write the features as raw little-endian float32 values, so that the module
+// can load them with numpy.fromfile instead of parsing the output vector string.
+inline bool WriteFeaturesFile( const std::string & fileName, std::vector<float> features )
+{
+  itk::ByteSwapper<float>::SwapRangeFromSystemToLittleEndian( features.data(), features.size() );
+  std::ofstream file( fileName.c_str(), std::ios::out | std::ios::binary );
+  file.write( reinterpret_cast<const char *>( features.data() ), features.size() * sizeof(float) );
+  return file.good();
+}
+
+#endif